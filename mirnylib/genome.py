@@ -52,6 +52,135 @@ h = logging.NullHandler()
 log.addHandler(h)
 
 
+def _readChrmSequence(fastaName, chrmLabel):
+    '''Read one chromosome sequence as a plain string. chrmLabel is None
+    for one-file-per-chromosome genomes and a record name for single-file
+    genomes.'''
+    if chrmLabel is None:
+        return str(Bio.SeqIO.read(open(fastaName), 'fasta').seq)
+    else:
+        import pyfaidx
+        return str(pyfaidx.Fasta(fastaName)[chrmLabel])
+
+
+def _binSummaryFromBuffer(buf, resolution):
+    '''Per-bin GC count, mapped-base count and bin length for one
+    uppercase-ASCII uint8 sequence buffer, reduced at the bin boundaries
+    with numpy.add.reduceat.'''
+    chrmSizeBin = int(len(buf) // resolution) + 1
+    edges = numpy.arange(0, chrmSizeBin * resolution, resolution)
+    edges = edges[edges < len(buf)]
+    gc = ((buf == ord('G')) | (buf == ord('C'))).astype(numpy.int32)
+    mapped = (buf != ord('N')).astype(numpy.int32)
+    # The trailing bin of an exactly-divisible chromosome is empty;
+    # pad the reduced counts back to the full bin count.
+    gcCount = numpy.zeros(chrmSizeBin, dtype=numpy.int64)
+    mappedCount = numpy.zeros(chrmSizeBin, dtype=numpy.int64)
+    binLens = numpy.zeros(chrmSizeBin, dtype=numpy.int64)
+    gcCount[:len(edges)] = numpy.add.reduceat(gc, edges)
+    mappedCount[:len(edges)] = numpy.add.reduceat(mapped, edges)
+    binLens[:len(edges)] = numpy.diff(numpy.r_[edges, len(buf)])
+    return gcCount, mappedCount, binLens
+
+
+def _chrmBinSummaryWorker(fastaName, chrmLabel, resolution):
+    '''Compute the bin summary of one chromosome in a joblib worker.
+    Reads the sequence itself, so only the reduced per-bin arrays cross
+    the process boundary.'''
+    seq = _readChrmSequence(fastaName, chrmLabel)
+    buf = numpy.frombuffer(seq.encode('ascii'), dtype=numpy.uint8) & 0xDF
+    return _binSummaryFromBuffer(buf, int(resolution))
+
+
+# IUPAC nucleotide codes over uppercase ASCII.
+_IUPAC_BASES = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT',
+}
+
+
+def _searchSiteVectorized(buf, enzyme):
+    '''Scan an uppercase-ASCII uint8 buffer for the recognition site of
+    a palindromic enzyme, one vectorized byte-table lookup per site
+    position instead of Bio.Restriction's per-character Python walk.
+    Returns the 1-based cut positions in Bio search() coordinates, or
+    None when the enzyme needs the general Bio machinery.'''
+    site = enzyme.site
+    if site is None or enzyme.fst5 is None or not enzyme.is_palindromic():
+        return None
+    site = site.upper()
+    if any(c not in _IUPAC_BASES for c in site):
+        return None
+    n = len(buf) - len(site) + 1
+    if n <= 0:
+        return numpy.array([], dtype=numpy.int64)
+    hits = numpy.ones(n, dtype=bool)
+    lut = numpy.zeros(256, dtype=bool)
+    for j, code in enumerate(site):
+        if code == 'N':
+            # Bio.Restriction compiles N to the regex '.', which matches
+            # any character -- including the Ns of assembly gaps. An
+            # ACGT-only test here would silently drop sites overlapping
+            # gaps, so an N column constrains nothing.
+            continue
+        lut[:] = False
+        lut[[ord(c) for c in _IUPAC_BASES[code]]] = True
+        hits &= lut[buf[j:j + n]]
+    return numpy.flatnonzero(hits) + enzyme.fst5 + 1
+
+
+def _findRsitePositions(seq, enzymeName):
+    '''Restriction-site positions of one sequence in Bio search()
+    coordinates. Palindromic enzymes with concrete IUPAC sites go
+    through the vectorized scanner; the rest fall back to
+    Bio.Restriction.'''
+    enzyme = getattr(Bio.Restriction, enzymeName)
+    seqStr = str(seq)
+    buf = numpy.frombuffer(seqStr.encode('ascii'), dtype=numpy.uint8) & 0xDF
+    positions = _searchSiteVectorized(buf, enzyme)
+    if positions is None:
+        positions = numpy.array(enzyme.search(Bio.Seq.Seq(seqStr)))
+    return positions
+
+
+def _chrmRsitesWorker(fastaName, chrmLabel, enzymeName):
+    '''Find the restriction sites of one chromosome in a joblib worker.
+    Returns the site positions and the chromosome length.'''
+    seq = _readChrmSequence(fastaName, chrmLabel)
+    return _findRsitePositions(seq, enzymeName), len(seq)
+
+
+class _LazyChrmSequences(object):
+    '''A list-like accessor for chromosome sequences that reads each
+    chromosome from disk on first access and caches it, so touching one
+    chromosome does not pull the whole genome into memory.'''
+    def __init__(self, genome):
+        self._genome = genome
+        self._cache = {}
+        self._fastaRecords = None
+
+    def __len__(self):
+        return self._genome.chrmCount
+
+    def __getitem__(self, chrm):
+        if chrm not in self._cache:
+            genome = self._genome
+            if not genome.singleFile:
+                self._cache[chrm] = Bio.SeqIO.read(
+                    open(genome.fastaNames[chrm]), 'fasta')
+            else:
+                import pyfaidx
+                if self._fastaRecords is None:
+                    self._fastaRecords = pyfaidx.Fasta(genome.singleFile)
+                # monkey patch to behave like SeqIO object for now
+                seq = Bio.Seq.Seq(
+                    str(self._fastaRecords[genome.chrmLabels[chrm]]))
+                seq.seq = seq
+                self._cache[chrm] = seq
+        return self._cache[chrm]
+
+
 class Genome(object):
     """A class to compute and cache various properties of genomic sequences."""
 
@@ -64,7 +193,17 @@ class Genome(object):
         The drawback is that _memoize() doesn't check for the changes in the
         code of the function!'''
         if not hasattr(self, '_mymem'):
-            self._mymem = joblib.Memory(cachedir=self.cacheDir)
+            # Store cached arrays uncompressed so reloads memory-map the
+            # .npy files instead of unpickling and decompressing copies.
+            try:
+                self._mymem = joblib.Memory(
+                    location=self.cacheDir, compress=False, mmap_mode='r',
+                    verbose=0)
+            except TypeError:
+                # joblib < 0.12 spells the location argument 'cachedir'.
+                self._mymem = joblib.Memory(
+                    cachedir=self.cacheDir, compress=False, mmap_mode='r',
+                    verbose=0)
 
         def run_func(readChrms, gapFile, chrmFileTemplate,
                      func_name, genomeName, *args, **kwargs):
@@ -173,14 +312,18 @@ class Genome(object):
         gapFile.close()
 
     def _extractChrmLabel(self, fastaName):
+        # Compile the template patterns once; this runs for every FASTA
+        # file and in sort keys, so recompiling per call adds up.
+        if not hasattr(self, '_chrmLabelRe'):
+            self._chrmLabelRe = re.compile(self.chrmFileTemplate % ('(.*)'))
+            self._chrmLabelStemRe = re.compile(
+                self.chrmFileTemplate.split('.')[0] % ('(.*)'))
         # First assume a whole filename as input (e.g. 'chr01.fa')
         _, fastaName = os.path.split(fastaName)
-        regexp = self.chrmFileTemplate % ('(.*)')
-        search_results = re.search(regexp, fastaName)
+        search_results = self._chrmLabelRe.search(fastaName)
         # If not, assume that only the name is supplied as input (e.g. 'chr01')
         if search_results is None:
-            regexp = self.chrmFileTemplate.split('.')[0] % ('(.*)')
-            search_results = re.search(regexp, fastaName)
+            search_results = self._chrmLabelStemRe.search(fastaName)
 
         if search_results is None:
             raise Exception(
@@ -228,8 +371,10 @@ class Genome(object):
         if not self.forceOrder:
             num_ids = [i for i in self.chrmLabels if i.isdigit()]
             log.debug('The chromosomes with numerical IDs: {0}'.format(num_ids))
-            # Sort IDs naturally, i.e. place '2' before '10'.
-            num_ids.sort(key=lambda x: int(re.findall(r'\d+$', x)[0]))
+            # Sort IDs naturally, i.e. place '2' before '10'. The labels
+            # already passed isdigit(), so the integer keys are computed
+            # once per label instead of running a regex on every comparison.
+            num_ids.sort(key=int)
 
             self.chrmCount = len(num_ids)
             self.label2idx = dict(
@@ -466,7 +611,11 @@ class Genome(object):
         self.chrmLens = self.getChrmLen()
         self.maxChrmLen = max(self.chrmLens)
         # FragIDmult is used in (chrm, frag) -> fragID conversion.
-        self.fragIDmult = self.maxChrmLen + 1000
+        # It is rounded up to the next power of two, so that decomposing
+        # a fragID back into (chrm, position) is a single shift or mask
+        # instead of a 64-bit integer division on the hot paths.
+        self._fragIDShift = int(self.maxChrmLen + 1000 - 1).bit_length()
+        self.fragIDmult = 1 << self._fragIDShift
 
         # Parse a gap file and mark the centromere positions.
         self._parseGapFile()
@@ -486,14 +635,76 @@ class Genome(object):
         self.getGCBin = self._memoize('_getGCBin')
         return self.getGCBin(resolution)
 
+    def _getSeqBuffer(self, chrm):
+        '''The chromosome sequence as an uppercase-ASCII uint8 array.
+        Built once per chromosome and cached on the instance, so that the
+        GC, unmapped-base and restriction computations share one buffer.'''
+        if not hasattr(self, '_seqBuffers'):
+            self._seqBuffers = {}
+        if chrm not in self._seqBuffers:
+            seq = self.seqs[chrm]
+            myseq = seq.seq if hasattr(seq, "seq") else seq
+            buf = numpy.frombuffer(
+                str(myseq).encode('ascii'), dtype=numpy.uint8)
+            self._seqBuffers[chrm] = buf & 0xDF  # uppercase ASCII
+        return self._seqBuffers[chrm]
+
+    def _binSummaries(self, chrm, resolution):
+        '''One fused pass over a chromosome: per-bin GC count, mapped-base
+        count and bin length, reduced at the bin boundaries with
+        numpy.add.reduceat. Cached per (chromosome, resolution), so that
+        _getGCBin and _getUnmappedBasesBin read the sequence only once.'''
+        if not hasattr(self, '_binSummaryCache'):
+            self._binSummaryCache = {}
+        cacheKey = (chrm, int(resolution))
+        if cacheKey not in self._binSummaryCache:
+            self._binSummaryCache[cacheKey] = _binSummaryFromBuffer(
+                self._getSeqBuffer(chrm), int(resolution))
+        return self._binSummaryCache[cacheKey]
+
+    def _workerArgs(self, chrm):
+        '''(fastaName, chrmLabel) arguments for the module-level joblib
+        workers, for either genome layout.'''
+        if not self.singleFile:
+            return self.fastaNames[chrm], None
+        return self.singleFile, self.chrmLabels[chrm]
+
+    def _computeBinSummaries(self, resolution):
+        '''Fill the bin-summary cache for all chromosomes at once,
+        fanning the per-chromosome passes out over the available cores.
+        Chromosomes whose sequence buffer is already resident are
+        summarized in-process, since re-reading them in a worker would
+        cost more than the reduction itself.'''
+        if not hasattr(self, '_binSummaryCache'):
+            self._binSummaryCache = {}
+        resolution = int(resolution)
+        toDispatch = [
+            chrm for chrm in range(self.chrmCount)
+            if (chrm, resolution) not in self._binSummaryCache
+            and chrm not in getattr(self, '_seqBuffers', {})]
+        if len(toDispatch) > 1:
+            results = joblib.Parallel(n_jobs=-1)(
+                joblib.delayed(_chrmBinSummaryWorker)(
+                    self._workerArgs(chrm)[0], self._workerArgs(chrm)[1],
+                    resolution)
+                for chrm in toDispatch)
+            for chrm, summary in zip(toDispatch, results):
+                self._binSummaryCache[(chrm, resolution)] = summary
+
     def _getGCBin(self, resolution):
+        '''Count GC per bin using the fused vectorized pass of
+        _binSummaries instead of re-slicing the sequence for every bin.'''
+        self._computeBinSummaries(resolution)
         GCBin = []
         for chrm in range(self.chrmCount):
-            chrmSizeBin = int(self.chrmLens[chrm] // resolution) + 1
-            GCBin.append(numpy.ones(chrmSizeBin, dtype=numpy.float))
-            for j in range(chrmSizeBin):
-                GCBin[chrm][j] = self.getGC(
-                    chrm, j * int(resolution), (j + 1) * int(resolution))
+            gcCount, mappedCount, binLens = self._binSummaries(
+                chrm, resolution)
+            # Bins without a single mapped base get -1, as in getGC().
+            track = -1.0 * numpy.ones(len(gcCount))
+            nonzero = mappedCount > 0
+            track[nonzero] = (100.0 * gcCount[nonzero]) / mappedCount[nonzero]
+            track[binLens == 0] = 0.0
+            GCBin.append(track)
         return GCBin
 
     def getUnmappedBasesBin(self, resolution):
@@ -503,13 +714,19 @@ class Genome(object):
         return self.getUnmappedBasesBin(resolution)
 
     def _getUnmappedBasesBin(self, resolution):
+        '''Count the percentage of unmapped (N) bases per bin from the
+        same fused pass as _getGCBin.'''
+        self._computeBinSummaries(resolution)
         unmappedBasesBin = []
         for chrm in range(self.chrmCount):
-            chrmSizeBin = int(self.chrmLens[chrm] // resolution) + 1
-            unmappedBasesBin.append(numpy.ones(chrmSizeBin, dtype=numpy.float))
-            for j in range(chrmSizeBin):
-                unmappedBasesBin[chrm][j] = self.getUnmappedBases(
-                    chrm, j * int(resolution), (j + 1) * int(resolution))
+            gcCount, mappedCount, binLens = self._binSummaries(
+                chrm, resolution)
+            track = numpy.zeros(len(binLens), dtype=float)
+            nonzero = binLens > 0
+            track[nonzero] = (100.0 * (binLens[nonzero]
+                                       - mappedCount[nonzero])
+                              / binLens[nonzero])
+            unmappedBasesBin.append(track)
         return unmappedBasesBin
 
     def getRsites(self, enzymeName):
@@ -530,11 +747,22 @@ class Genome(object):
             for i in range(self.chrmCount):
                 rsites.append(np.r_[np.arange(0, self.chrmLens[i]-100, enzymeName), self.chrmLens[i]])
         else:
-            enzymeSearchFunc = eval('Bio.Restriction.%s.search' % enzymeName)
-            for i in range(self.chrmCount):
-                rsites.append(numpy.r_[
-                    0, numpy.array(enzymeSearchFunc(self.seqs[i].seq)) + 1,
-                    len(self.seqs[i].seq)])
+            resident = getattr(self, '_seqs', None)
+            if resident is not None and len(resident._cache) == self.chrmCount:
+                # All sequences are already in memory; a process pool
+                # would only re-read them from disk.
+                searchResults = [
+                    (_findRsitePositions(self.seqs[i].seq, enzymeName),
+                     len(self.seqs[i].seq))
+                    for i in range(self.chrmCount)]
+            else:
+                searchResults = joblib.Parallel(n_jobs=-1)(
+                    joblib.delayed(_chrmRsitesWorker)(
+                        self._workerArgs(i)[0], self._workerArgs(i)[1],
+                        enzymeName)
+                    for i in range(self.chrmCount))
+            for positions, chrmLen in searchResults:
+                rsites.append(numpy.r_[0, positions + 1, chrmLen])
 
         for i in range(self.chrmCount):
             rfragMids.append((rsites[i][:-1] + rsites[i][1:]) // 2)
@@ -549,20 +777,7 @@ class Genome(object):
     @property
     def seqs(self):
         if not hasattr(self, "_seqs"):
-            if not self.singleFile:
-                self._seqs = []
-                for i in range(self.chrmCount):
-                    self._seqs.append(Bio.SeqIO.read(open(self.fastaNames[i]),
-                                                     'fasta'))
-            else:
-                import pyfaidx
-                fasta_records = pyfaidx.Fasta(self.singleFile)
-                self._seqs = []
-                for name in self.chrmLabels:
-                    # monkey patch to behave like SeqIO object for now
-                    seq = Bio.Seq.Seq(str(fasta_records[name]))
-                    seq.seq = seq
-                    self._seqs.append(seq)
+            self._seqs = _LazyChrmSequences(self)
         return self._seqs
 
     def setResolution(self, resolution):
@@ -642,32 +857,24 @@ class Genome(object):
         self.chrmEndsBinCont = numpy.cumsum(self.chrmLensBin)
         self.numBins = self.chrmEndsBinCont[-1]
 
-        self.chrmIdxBinCont = numpy.zeros(self.numBins, int)
-        self.binStartPosCont = numpy.zeros(self.numBins, int)
-        self.binEndPosCont = numpy.zeros(self.numBins, int)
-        self.posBinCont = numpy.zeros(self.numBins, int)
-        
-        for i in range(self.chrmCount):
-            st = self.chrmStartsBinCont[i]
-            end = self.chrmEndsBinCont[i]
-            self.chrmIdxBinCont[st:end] = i
-            self.binStartPosCont[st:end] = resolution * np.arange(end - st, dtype = int)
-            self.binEndPosCont[st:end-1] = self.binStartPosCont[st+1:end]
-            self.binEndPosCont[end-1] = self.chrmLens[i]
-
-        
-        for i in range(self.chrmCount):
-            self.posBinCont[
-                self.chrmStartsBinCont[i]:self.chrmEndsBinCont[i]] = (
-                    self.resolution
-                    * numpy.arange(-self.chrmStartsBinCont[i]
-                                   + self.chrmEndsBinCont[i]))
+        # One vectorized construction per field instead of a Python loop
+        # over chromosomes.
+        self.chrmIdxBinCont = numpy.repeat(
+            numpy.arange(self.chrmCount, dtype=int), self.chrmLensBin)
+        self.posBinCont = self.resolution * (
+            numpy.arange(self.numBins, dtype=int)
+            - self.chrmStartsBinCont[self.chrmIdxBinCont])
+        binSizes = numpy.full(self.numBins, self.resolution, dtype=int)
+        binSizes[self.chrmEndsBinCont - 1] = (
+            self.chrmLens - self.resolution * (self.chrmLensBin - 1))
+        self.binStartPosCont = self.posBinCont.copy()
+        self.binEndPosCont = self.binStartPosCont + binSizes
 
         # Bin centromeres.
         self.cntrMidsBinCont = (self.chrmStartsBinCont
                                 + self.cntrMids // self.resolution)
         self.chrmArmBordersBinCont = numpy.zeros(
-            self.chrmCount * 2 + 1, dtype=numpy.int)
+            self.chrmCount * 2 + 1, dtype=int)
         self.chrmArmBordersBinCont[1::2] = self.cntrMidsBinCont
         self.chrmArmBordersBinCont[2::2] = self.chrmEndsBinCont
         self.chrmArmLensBin = self.chrmArmBordersBinCont[1:] - \
@@ -676,12 +883,7 @@ class Genome(object):
         # Bin GC content.
         self.GCBin = self.getGCBin(self.resolution)
         self.unmappedBasesBin = self.getUnmappedBasesBin(self.resolution)
-        self.binSizesBp = []
-        for i in range(self.chrmCount):
-            chromLen = self.chrmLens[i]
-            cur = [self.resolution for _ in range(chromLen // self.resolution)]
-            cur.append(chromLen % self.resolution)
-            self.binSizesBp.append(numpy.array(cur))
+        self.binSizesBp = self.splitByChrms(binSizes)
         self.mappedBasesBin = [numpy.array(i[0] * (100. - i[1]) / 100, int)
                 for i in zip(self.binSizesBp, self.unmappedBasesBin)]
 
@@ -883,23 +1085,25 @@ class Genome(object):
         """
 
         """
-        chromSet = set(chromosomes)
-        if 0 not in chromSet:
+        chromosomes = numpy.asarray(chromosomes)
+        minChrm = chromosomes.min()
+        maxChrm = chromosomes.max()
+        if minChrm != 0:
             warnings.warn("Chromosome zero not found! Are you using"
                           " zero-based chromosomes?", UserWarning)
-        if max(chromSet) >= self.chrmCount:
+        if maxChrm >= self.chrmCount:
             raise Exception("Chromosome number %d exceeds expected"
                                 " chromosome count %d" %
-                                (max(chromSet), self.chrmCount))
-        if max(chromSet) < self.chrmCount - 1:
+                                (maxChrm, self.chrmCount))
+        if maxChrm < self.chrmCount - 1:
             warnings.warn("More chromosomes in the genome (%d)  than we got"
                           " (%d) ! Are you using proper genome?" %
-                          (self.chrmCount, max(chromSet) - 1))
+                          (self.chrmCount, maxChrm - 1))
         maxpositions = self.chrmLens[chromosomes]
         check = positions > maxpositions
         if check.any():  # found positions that exceeds chromosme length
-            inds = numpy.nonzero(check)[0]
-            inds = inds[::len(inds) // 10]
+            inds = numpy.flatnonzero(check)
+            inds = inds[::max(1, len(inds) // 10)]
             for i in inds:
                 raise Exception("Position %d on chrm %d exceeds "
                                     "maximum positions %d" % (
@@ -942,14 +1146,15 @@ class Genome(object):
         frag2ind = numpy.searchsorted(self.rfragMidIds, fragments2)
         distance = numpy.abs(frag1ind - frag2ind)
         del frag1ind, frag2ind
-        ch1 = fragments1 // self.fragIDmult
-        ch2 = fragments2 // self.fragIDmult
+        ch1 = numpy.right_shift(numpy.asarray(fragments1, dtype=numpy.int64),
+                                self._fragIDShift)
+        ch2 = numpy.right_shift(numpy.asarray(fragments2, dtype=numpy.int64),
+                                self._fragIDShift)
         distance[ch1 != ch2] = 1000000
         return distance
 
     def getPairsLessThanDistance(self, fragments1, fragments2,
                                  cutoffDistance, enzymeName):
-        from . import numutils
         """returns all possible pairs (fragment1,fragment2)
         with fragment distance less-or-equal than cutoff"""
         if not hasattr(self, "rfragMidIds"):
@@ -960,13 +1165,13 @@ class Genome(object):
         assert (fragments1[::100] - self.rfragMidIds[f1ID[::100]]).sum() == 0
         assert (fragments2[::100] - self.rfragMidIds[f2ID[::100]]).sum() == 0
 
-        fragment2Candidates = numpy.concatenate(
-            [f1ID + i for i in (list(range(-cutoffDistance, 0)) +
-                                list(range(1, cutoffDistance + 1)))])
-        fragment1Candidates = numpy.concatenate(
-            [f1ID for i in (list(range(-cutoffDistance, 0)) +
-                            list(range(1, cutoffDistance + 1)))])
-        mask = numutils.arrayInArray(fragment2Candidates, f2ID)
+        offsets = numpy.concatenate(
+            [numpy.arange(-cutoffDistance, 0),
+             numpy.arange(1, cutoffDistance + 1)])
+        fragment2Candidates = (f1ID[:, None] + offsets[None, :]).ravel()
+        fragment1Candidates = numpy.broadcast_to(
+            f1ID[:, None], (len(f1ID), len(offsets))).ravel()
+        mask = numpy.isin(fragment2Candidates, f2ID)
 
         fragment2Real = fragment2Candidates[mask]
         fragment1Real = fragment1Candidates[mask]
@@ -1007,10 +1212,50 @@ class Genome(object):
             useM = False
             Mnum = 0
 
-        from .fastExtensions.fastExtensionspy import readWigFile  # @UnresolvedImport
-        readWigFile(myfilename, data, chromCount,
-                            useX, useY, useM,
-                            Xnum, Ynum, Mnum, Mkb, resolution)
+        # Parse the file in bulk with numpy instead of the old compiled
+        # extension: a fixedStep block is a header line followed by plain
+        # numbers, so all values of a block are converted in one C call
+        # and summed into their bins with numpy.add.at.
+        with open(myfilename, 'rb') as wigFile:
+            raw = wigFile.read()
+        for block in raw.split(b'fixedStep')[1:]:
+            headerEnd = block.find(b'\n')
+            fields = dict(i.split(b'=', 1)
+                          for i in block[:headerEnd].split() if b'=' in i)
+            chromLabel = fields[b'chrom'][3:].decode('ascii')  # strip 'chr'
+            start = int(fields[b'start'])
+            step = int(fields.get(b'step', b'1'))
+
+            skip = False
+            if chromLabel == 'X':
+                chrom = Xnum
+                skip = not useX
+            elif chromLabel == 'Y':
+                chrom = Ynum
+                skip = not useY
+            elif chromLabel == 'M':
+                chrom = Mnum
+                skip = not useM
+            else:
+                try:
+                    chrom = int(chromLabel)
+                except ValueError:
+                    chrom = 0
+            if (chrom == 0) or (chrom > chromCount):
+                skip = True
+            if skip:
+                log.info('Skipping chromosome %s', chromLabel)
+                continue
+
+            values = numpy.array(block[headerEnd + 1:].split(),
+                                 dtype=numpy.double)
+            positions = start + step * numpy.arange(len(values))
+            bins = Mkb * (chrom - 1) + positions // resolution
+            valid = bins < Mkb * chromCount
+            if not valid.all():
+                log.warning('Wig entries of chromosome %s exceed the '
+                            'expected chromosome length', chromLabel)
+            numpy.add.at(data, bins[valid], values[valid])
 
         datas = [data[i * Mkb:(i + 1) * Mkb] for i in range(self.chrmCount)]
         for chrom, track in enumerate(datas):
@@ -52,7 +52,10 @@ def convertFile(filename, folder, gz=True):
     if not os.path.exists(folder):
         os.mkdir(folder)
 
-    mydict = h5dict(filename, 'r')
+    # This tool dumps every key whole anyway; disable the lazy-proxy
+    # threshold so large arrays come back as real ndarrays and take the
+    # array branch below.
+    mydict = h5dict(filename, 'r', eager_threshold_bytes=float('inf'))
     for i in list(mydict.keys()):
         data = mydict[i]
         savefile = os.path.join(folder, i)
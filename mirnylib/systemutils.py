@@ -111,25 +111,91 @@ def deprecate(newFunction, oldFunctionName=None, message=None):
         return newFunction(*args, **kwargs)
     return oldFunction
 
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+# Arrays smaller than that still go through the pickle pipe: creating a
+# shared-memory segment has a fixed cost that only pays off for big results.
+_shmMinBytes = 1 << 20
+
+
+class _ShmArrayRef(object):
+    '''A pickle placeholder for an ndarray returned by an fmap worker:
+    the payload is memcpy'd into a POSIX shared-memory segment and only
+    (name, shape, dtype) travel through the pipe, so the parent rewraps
+    the buffer instead of deserializing a byte-for-byte pickle copy.'''
+
+    def __init__(self, arr):
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[...] = arr
+        self.name = shm.name
+        self.shape = arr.shape
+        self.dtype = arr.dtype.str
+        shm.close()
+
+    def load(self):
+        shm = shared_memory.SharedMemory(name=self.name)
+        arr = np.ndarray(self.shape, np.dtype(self.dtype),
+                         buffer=shm.buf).copy()
+        shm.close()
+        shm.unlink()
+        return arr
+
+
+def _shmExport(result):
+    # Object arrays hold PyObject pointers, which are meaningless (and
+    # deadly to dereference) outside the worker that created them; only
+    # plain numeric buffers can travel through shared memory.
+    if (shared_memory is not None and isinstance(result, np.ndarray)
+            and not result.dtype.hasobject
+            and result.nbytes >= _shmMinBytes):
+        return _ShmArrayRef(result)
+    return result
+
+
+def _shmImport(result):
+    if isinstance(result, _ShmArrayRef):
+        return result.load()
+    return result
+
+
 def _nprocessors():
-    if sys.platform == 'darwin':
-        try:
-            from multiprocessing import cpu_count
-            return cpu_count()
-        except NotImplementedError:
-            pass
-    else:
-        # Cygwin (Windows) and Linuxes
-        # Could try sysconf(_SC_NPROCESSORS_ONLN) (LSB) next.  Instead, count processors in cpuinfo.
-        try:
-            s = open('/proc/cpuinfo', 'r').read()
-            return s.replace(' ', '').replace('\t', '').count('processor:')
-        except:
-            pass
-    return 4
+    # The affinity mask respects cgroup/taskset limits on containers and
+    # HPC nodes, where the raw core count would oversubscribe.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on Mac / Windows
+        return os.cpu_count() or 1
 
 nproc = _nprocessors()
 
+_pool = None
+_poolSize = 0
+
+
+def closePool():
+    '''Dispose of the multiprocessing pool cached by fmap.'''
+    global _pool, _poolSize
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+        _poolSize = 0
+
+
+def _getPool(n):
+    global _pool, _poolSize
+    if _pool is None or _poolSize != n:
+        closePool()
+        import multiprocessing
+        _pool = multiprocessing.Pool(n)
+        _poolSize = n
+    return _pool
+
+
 def fmap(f, *a, **kw):
     """
     forkmap.map(..., n=nprocessors), same as map(...).
@@ -143,8 +209,35 @@ def fmap(f, *a, **kw):
         return list(map(f, *a))
 
     L = list(zip(*a))
+    if not L:
+        return []
     n = min(n, len(L))
 
+    try:
+        # Functions that pickle by reference can run on the cached pool:
+        # no per-call forks, and work is balanced in chunks instead of
+        # fixed equal slices. Lambdas and closures (which the fmapred
+        # helpers rely on) cannot, and take the fork path below.
+        pickle.dumps(f)
+        picklable = True
+    except Exception:
+        picklable = False
+    if picklable:
+        pool = _getPool(n)
+        chunksize = max(1, len(L) // (4 * n))
+        if len(a) == 1:
+            # zip() above already consumed a[0]: for a one-shot iterable
+            # the items only survive inside L.
+            return pool.map(f, [x[0] for x in L], chunksize)
+        return pool.starmap(f, L, chunksize)
+
+    if shared_memory is not None:
+        # Spawn the resource tracker before forking, so the children's
+        # shared-memory registrations and the parent's unlinks talk to
+        # the same tracker process and nothing is reported as leaked.
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+
     ans = [None] * len(L)
     pipes = [os.pipe() for i in range(n - 1)]
 
@@ -152,7 +245,7 @@ def fmap(f, *a, **kw):
         if i < n - 1 and not os.fork():  # Child, and not last processor
             try:
                 try:
-                    obj = [f(*x) for x in L[i::n]]
+                    obj = [_shmExport(f(*x)) for x in L[i::n]]
                 except Exception as obj:
                     pass
                 with os.fdopen(pipes[i][1],'wb') as f:
@@ -169,7 +262,7 @@ def fmap(f, *a, **kw):
                         obj = pickle.load(f)
                     if isinstance(obj, Exception):
                         raise obj
-                    ans[k::n] = obj
+                    ans[k::n] = [_shmImport(x) for x in obj]
             finally:
                 for j in range(n - 1):
                     os.wait()
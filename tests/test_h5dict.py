@@ -0,0 +1,153 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath('..'))
+
+import pickle
+import tempfile
+import unittest
+
+import numpy
+import h5py
+
+from mirnylib.h5dict import h5dict, _DatasetProxy
+
+
+class TestH5dict(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.hdf5')
+        self.d = h5dict(self.path, 'w')
+
+    def tearDown(self):
+        self.d.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _reopen(self, mode='r'):
+        self.d.close()
+        self.d = h5dict(self.path, mode)
+
+    def test_roundtrip(self):
+        arr = numpy.random.random((300, 200))
+        self.d['array'] = arr
+        self.d['scalar'] = 42
+        self.d['text'] = 'hello'
+        self.d['blob'] = {'a': 1, 'x': numpy.arange(10)}
+
+        self._reopen()
+        self.assertTrue(numpy.allclose(numpy.asarray(self.d['array']), arr))
+        self.assertEqual(self.d['scalar'], 42)
+        self.assertEqual(self.d['text'], 'hello')
+        blob = self.d['blob']
+        self.assertEqual(blob['a'], 1)
+        self.assertTrue(numpy.array_equal(blob['x'], numpy.arange(10)))
+        self.assertEqual(sorted(self.d.keys()),
+                         ['array', 'blob', 'scalar', 'text'])
+        self.assertEqual(len(self.d), 4)
+        self.assertIn('array', self.d)
+        self.assertNotIn('nope', self.d)
+        self.assertIs(self.d.value_type('array'), numpy.ndarray)
+        self.assertEqual(self.d.value_dtype('array'), numpy.dtype(float))
+
+    def test_delete_and_rename(self):
+        self.d['a'] = numpy.arange(5)
+        self.d['b'] = 'small pickled value'
+        del self.d['a']
+        self.assertNotIn('a', self.d)
+        self.d.rename('b', 'c')
+        self.assertNotIn('b', self.d)
+        self.assertEqual(self.d['c'], 'small pickled value')
+        self.assertEqual(len(self.d), 1)
+
+    def test_same_shape_overwrite(self):
+        arr = numpy.random.random((400, 300))
+        self.d['a'] = arr
+        self.d.flush()
+        size1 = os.path.getsize(self.path)
+        for _ in range(5):
+            arr = numpy.random.random((400, 300))
+            self.d['a'] = arr
+        self.d.flush()
+        # In-place refills must not leave dead copies behind.
+        self.assertLess(os.path.getsize(self.path), size1 + arr.nbytes)
+        self.assertTrue(numpy.allclose(numpy.asarray(self.d['a']), arr))
+        # A shape or dtype change still replaces the dataset.
+        self.d['a'] = numpy.arange(10, dtype=numpy.int32)
+        self.assertTrue(numpy.array_equal(
+            numpy.asarray(self.d['a']), numpy.arange(10)))
+        self.assertEqual(self.d.value_dtype('a'), numpy.dtype(numpy.int32))
+
+    def test_lazy_proxy(self):
+        arr = numpy.random.random((200, 100))
+        self.d['a'] = arr
+        self.d.close()
+        self.d = h5dict(self.path, 'r', eager_threshold_bytes=1024)
+        proxy = self.d['a']
+        self.assertIsInstance(proxy, _DatasetProxy)
+        self.assertEqual(proxy.shape, arr.shape)
+        self.assertTrue(numpy.allclose(proxy[10:20], arr[10:20]))
+        self.assertTrue(numpy.allclose(numpy.asarray(proxy), arr))
+
+    def test_old_format_load(self):
+        # A file laid out the way pre-JSON h5dicts wrote it: values
+        # pickled into zero-dim string datasets and the metadata blob
+        # pickled under the reserved key.
+        path = tempfile.mktemp(suffix='.hdf5')
+        with h5py.File(path, 'w') as f:
+            f.create_dataset('arr', data=numpy.arange(20))
+            f.create_dataset('obj', data=numpy.array(pickle.dumps({'k': 3})))
+            f.create_dataset(h5dict.self_key, data=numpy.array(pickle.dumps(
+                {'_types': {'arr': numpy.ndarray, 'obj': dict},
+                 '_dtypes': {'arr': numpy.dtype('int64'), 'obj': None}})))
+        old = h5dict(path, 'r')
+        try:
+            self.assertEqual(sorted(old.keys()), ['arr', 'obj'])
+            self.assertTrue(numpy.array_equal(
+                numpy.asarray(old['arr']), numpy.arange(20)))
+            self.assertEqual(old['obj'], {'k': 3})
+            self.assertIs(old.value_type('arr'), numpy.ndarray)
+            self.assertEqual(old.value_dtype('arr'), numpy.dtype('int64'))
+        finally:
+            old.close()
+            os.remove(path)
+
+    def test_close_and_reopen(self):
+        self.d['a'] = numpy.arange(30)
+        self.d.flush()
+        self.d.reopen()
+        self.assertTrue(numpy.array_equal(
+            numpy.asarray(self.d['a']), numpy.arange(30)))
+        self.d['b'] = 'still writable'
+        self.d.reopen('r')
+        self.assertEqual(self.d['b'], 'still writable')
+        self.assertRaises(Exception, self.d.__setitem__, 'c', 1)
+        # close() must be idempotent.
+        self.d.close()
+        self.d.close()
+        self.d = h5dict(self.path, 'r')
+
+    def test_repack(self):
+        for i in range(10):
+            self.d['key%d' % i] = numpy.random.random(100000)
+        self.d.flush()
+        for i in range(8):
+            del self.d['key%d' % i]
+        self.d.flush()
+        before = os.path.getsize(self.path)
+        self.d.repack()
+        self.assertLess(os.path.getsize(self.path), before // 2)
+        self.assertEqual(sorted(self.d.keys()), ['key8', 'key9'])
+        self.d['after'] = numpy.arange(4)
+        self._reopen()
+        self.assertTrue(numpy.array_equal(
+            numpy.asarray(self.d['after']), numpy.arange(4)))
+
+    def test_tmp_file_cleanup(self):
+        tmp = h5dict()
+        path = tmp.path
+        tmp['a'] = 1
+        tmp.close()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+        unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath('..'))
+
+import unittest
+
+import numpy
+
+from mirnylib import systemutils
+from mirnylib.systemutils import fmap
+
+
+def _double(x):
+    return 2 * x
+
+
+def _pair(x, y):
+    return x + 10 * y
+
+
+def _bigObjectArray(x):
+    # Above the shared-memory threshold, but full of PyObject pointers:
+    # must travel through the pickle pipe, never through shared memory.
+    arr = numpy.empty(150000, dtype=object)
+    arr[:] = [str(i) for i in range(150000)]
+    return arr
+
+
+def tearDownModule():
+    systemutils.closePool()
+
+
+class TestFmap(unittest.TestCase):
+    def test_lists(self):
+        self.assertEqual(fmap(_double, [1, 2, 3], n=2), [2, 4, 6])
+        self.assertEqual(fmap(_pair, [1, 2], [3, 4], n=2), [31, 42])
+        self.assertEqual(fmap(_double, list(range(30)), n=3),
+                         [2 * i for i in range(30)])
+
+    def test_iterator_input(self):
+        # One-shot iterables: zip() drains them, so fmap must map over
+        # the materialized items, not the spent iterator.
+        self.assertEqual(fmap(_double, iter([1, 2, 3, 4]), n=2),
+                         [2, 4, 6, 8])
+        self.assertEqual(fmap(_double, (i for i in range(5)), n=2),
+                         [0, 2, 4, 6, 8])
+        self.assertEqual(fmap(_pair, iter([1, 2]), iter([3, 4]), n=2),
+                         [31, 42])
+
+    def test_empty_input(self):
+        self.assertEqual(fmap(_double, [], n=4), [])
+        self.assertEqual(fmap(_double, iter([])), [])
+
+    def test_unpicklable_function(self):
+        # Lambdas cannot reach the pool and take the fork path.
+        self.assertEqual(fmap(lambda x: x * 3, iter([1, 2, 3]), n=2),
+                         [3, 6, 9])
+
+    def test_numeric_array_results(self):
+        res = fmap(lambda i: numpy.full(200000, i, dtype=float),
+                   [1, 2, 3], n=2)
+        for i, arr in enumerate(res, start=1):
+            self.assertTrue(numpy.all(arr == i))
+
+    def test_object_array_results(self):
+        res = fmap(lambda x: _bigObjectArray(x), [0, 1], n=2)
+        for arr in res:
+            self.assertEqual(len(arr), 150000)
+            self.assertEqual(arr[12345], '12345')
+
+
+if __name__ == '__main__':
+        unittest.main()